@@ -1,12 +1,22 @@
 # stockmon.py - Combined Stock Monitoring and Investment Tracking App
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, make_response, jsonify
+import csv
+import hashlib
+import io
+import re
+from flask import Flask, render_template, request, redirect, url_for, flash, make_response, jsonify, g, Response, abort
+import orjson
+import numpy as np
 import pandas as pd
 import sqlite3
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.io as pio
+from flask_compress import Compress
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm.attributes import set_committed_value
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -15,9 +25,13 @@ app.secret_key = 'your_secret_key_here'
 # Configuration
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['STOCK_DATABASE'] = 'stocks.db'
+app.config['SMALL_CSV_MAX_BYTES'] = 64 * 1024  # Uploads up to this size skip pandas (conservative cutoff)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///investments.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Compress responses (OHLCV history is embedded in the symbol pages)
+Compress(app)
+
 # Initialize SQLAlchemy for investments
 db = SQLAlchemy(app)
 
@@ -55,15 +69,19 @@ class Portfolio(db.Model):
     account = db.Column(db.String(100), nullable=False)
     investment_id = db.Column(db.Integer, db.ForeignKey('investment.id'))
     
-    @property
+    @hybrid_property
     def total_cost(self):
         return self.shares * self.average_price
     
-    @property
+    @hybrid_property
     def market_value(self):
         return self.shares * (self.latest_price if self.latest_price else self.average_price)
+
+    @market_value.expression
+    def market_value(cls):
+        return cls.shares * db.func.coalesce(db.func.nullif(cls.latest_price, 0), cls.average_price)
     
-    @property
+    @hybrid_property
     def profit(self):
         return self.market_value - self.total_cost
 
@@ -93,13 +111,41 @@ class AccountSnapshot(db.Model):
     def __repr__(self):
         return f'<AccountSnapshot {self.account_name} {self.date}>'
 
+# Composite indexes for the per-account and per-investment history lookups
+account_snapshot_date_index = db.Index('ix_acct_snap_name_date', AccountSnapshot.account_name, AccountSnapshot.date.desc())
+transaction_date_index = db.Index('ix_txn_inv_date', Transaction.investment_id, Transaction.date.desc())
+
 # Create tables
 with app.app_context():
     db.create_all()
+    # create_all() skips tables that already exist, so add the indexes to older databases too
+    account_snapshot_date_index.create(db.engine, checkfirst=True)
+    transaction_date_index.create(db.engine, checkfirst=True)
+
+# Open the stock database with per-connection tuning
+def connect_stock_db():
+    conn = sqlite3.connect(app.config['STOCK_DATABASE'])
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA mmap_size=268435456')
+    conn.execute('PRAGMA cache_size=-64000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+# One stock database connection per request, closed on teardown
+def get_stock_conn():
+    if 'stock_conn' not in g:
+        g.stock_conn = connect_stock_db()
+    return g.stock_conn
+
+@app.teardown_appcontext
+def close_stock_conn(exception):
+    conn = g.pop('stock_conn', None)
+    if conn is not None:
+        conn.close()
 
 # Initialize stock database
 def init_stock_db():
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
+    with connect_stock_db() as conn:
         cursor = conn.cursor()
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS stocks (
@@ -115,57 +161,147 @@ def init_stock_db():
             UNIQUE(symbol, date)
         );
         ''')
+        # UNIQUE(symbol, date) already indexes per-symbol lookups; this covers date-only filters and MAX(date)
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_stocks_date ON stocks(date)')
+        # One-row data version, bumped in every upload transaction so all workers agree on it
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        );
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO stock_meta (id, version) VALUES (1, 0)')
         conn.commit()
+        cursor.execute('PRAGMA journal_mode=WAL')
 
 init_stock_db()
 
+# Most recent close for every symbol as a {symbol: close} dict
+def _latest_prices(conn):
+    return pd.read_sql('''
+        SELECT s.symbol, s.close
+        FROM stocks s
+        JOIN (SELECT symbol, MAX(date) AS max_date FROM stocks GROUP BY symbol) m
+          ON s.symbol = m.symbol AND s.date = m.max_date
+    ''', conn).set_index('symbol')['close'].to_dict()
+
+# Latest prices only change when stock data is uploaded, so cache them per MAX(date)
+_price_cache = {'date': None, 'prices': {}}
+_price_cache_lock = threading.Lock()
+
+def get_latest_prices(conn):
+    max_date = conn.execute('SELECT MAX(date) FROM stocks').fetchone()[0]
+    with _price_cache_lock:
+        if _price_cache['date'] is None or _price_cache['date'] != max_date:
+            _price_cache['prices'] = _latest_prices(conn)
+            _price_cache['date'] = max_date
+        return _price_cache['prices']
+
+# Set latest prices on loaded portfolios without marking them dirty, so page views never write
+def apply_latest_prices(portfolios):
+    prices = get_latest_prices(get_stock_conn())
+    for p in portfolios:
+        latest_price = prices.get(p.symbol)
+        if latest_price:
+            set_committed_value(p, 'latest_price', latest_price)
+
+# Symbol list for the dropdowns, cached the same way
+_symbols_cache = {'date': None, 'symbols': []}
+_symbols_cache_lock = threading.Lock()
+
+def get_symbols(conn):
+    max_date = conn.execute('SELECT MAX(date) FROM stocks').fetchone()[0]
+    with _symbols_cache_lock:
+        if _symbols_cache['date'] is None or _symbols_cache['date'] != max_date:
+            _symbols_cache['symbols'] = [row[0] for row in conn.execute('SELECT DISTINCT symbol FROM stocks ORDER BY symbol')]
+            _symbols_cache['date'] = max_date
+        return _symbols_cache['symbols']
+
+def invalidate_stock_caches():
+    with _price_cache_lock:
+        _price_cache['date'] = None
+    with _symbols_cache_lock:
+        _symbols_cache['date'] = None
+
+STOCK_COLUMNS = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'nfb_nfs']
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+# Parse a small stock CSV with the csv module into STOCK_COLUMNS tuples.
+# Returns None when the file needs the pandas path (unknown layout, date format or value).
+def _read_small_csv(file):
+    try:
+        reader = csv.reader(io.StringIO(file.read().decode('utf-8-sig')))
+        first = next(reader, [])
+        # Empty file: let pandas report it as before
+        if not first:
+            return None
+        header = [h.strip().lower().replace('nfb/nfs', 'nfb_nfs') for h in first]
+
+        # Headerless CSV: the first line is already data in STOCK_COLUMNS order
+        if 'date' in header:
+            lines = reader
+        else:
+            header = STOCK_COLUMNS
+            lines = [first] + list(reader)
+        if 'symbol' not in header:
+            return None
+        # Columns missing from the header are stored as NULL
+        positions = [header.index(column) if column in header else None for column in STOCK_COLUMNS]
+
+        # A file usually holds a single trading date, so convert each distinct date once
+        iso_dates = {}
+        rows = []
+        for line in lines:
+            if not line:
+                continue
+            symbol, date, *values = (line[i].strip() if i is not None else '' for i in positions)
+            if date not in iso_dates:
+                iso_dates[date] = date if ISO_DATE.match(date) else datetime.strptime(date, '%m/%d/%Y').strftime('%Y-%m-%d')
+            rows.append((symbol, iso_dates[date], *(float(v) if v else None for v in values)))
+        return rows
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+    finally:
+        file.seek(0)
+
 # Stock Monitoring Routes
 @app.route('/stocks')
 def index():
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        # Get the most recent date across all stocks
-        latest_date = pd.read_sql('SELECT MAX(date) as max_date FROM stocks', conn)['max_date'].iloc[0]
-        
-        # Get all data for the latest date only with all columns
-        latest_data = pd.read_sql('''
-            SELECT symbol, date, open, high, low, close, volume, nfb_nfs 
-            FROM stocks 
-            WHERE date = ?
-            ORDER BY symbol
-        ''', conn, params=(latest_date,))
-        
-        # Calculate changes (if previous day data exists)
-        previous_closes = []
-        for symbol in latest_data['symbol']:
-            previous_close = pd.read_sql('''
-                SELECT close FROM stocks 
-                WHERE symbol = ? AND date < ?
-                ORDER BY date DESC 
-                LIMIT 1
-            ''', conn, params=(symbol, latest_date))['close'].iloc[0] if pd.read_sql('''
-                SELECT COUNT(*) as count FROM stocks 
-                WHERE symbol = ? AND date < ?
-            ''', conn, params=(symbol, latest_date))['count'].iloc[0] > 0 else None
-            previous_closes.append({'symbol': symbol, 'previous_close': previous_close})
-        
-        previous_closes_df = pd.DataFrame(previous_closes)
-        latest_data = pd.merge(latest_data, previous_closes_df, on='symbol')
-        
-        # Calculate price change percentage
-        latest_data['change_pct'] = latest_data.apply(
-            lambda row: ((row['close'] - row['previous_close']) / row['previous_close'] * 100 
-                        if row['previous_close'] and row['previous_close'] != 0 
-                        else 0), 
-            axis=1
-        ).round(2)
-        
-        # Get all available symbols for the dropdown
-        symbols = pd.read_sql('SELECT DISTINCT symbol FROM stocks ORDER BY symbol', conn)['symbol'].tolist()
+    conn = get_stock_conn()
+
+    # Get the most recent date across all stocks
+    latest_date = pd.read_sql('SELECT MAX(date) as max_date FROM stocks', conn)['max_date'].iloc[0]
+    
+    # Get all data for the latest date along with each symbol's previous close
+    latest_data = pd.read_sql('''
+        SELECT symbol, date, open, high, low, close, volume, nfb_nfs,
+               (SELECT p.close FROM stocks p
+                WHERE p.symbol = s.symbol AND p.date < s.date
+                ORDER BY p.date DESC
+                LIMIT 1) AS previous_close
+        FROM stocks s
+        WHERE date = ?
+        ORDER BY symbol
+    ''', conn, params=(latest_date,))
+
+    # Calculate price change percentage (0 when there is no usable previous close)
+    close = latest_data['close'].to_numpy(dtype=float)
+    previous_close = latest_data['previous_close'].to_numpy(dtype=float)
+    has_change = ~np.isnan(close) & ~np.isnan(previous_close) & (previous_close != 0)
+    latest_data['change_pct'] = np.where(
+        has_change,
+        (close - previous_close) / np.where(has_change, previous_close, 1) * 100,
+        0
+    ).round(2)
+    
+    # Get all available symbols for the dropdown
+    symbols = get_symbols(conn)
 
     # Get portfolio symbols (stocks the user holds)
-    portfolio_symbols = sorted(set(
-        p.symbol for p in Portfolio.query.filter(Portfolio.symbol != 'NON-STOCK').all()
-    ))
+    portfolio_symbols = [row[0] for row in db.session.query(Portfolio.symbol)
+                         .filter(Portfolio.symbol != 'NON-STOCK')
+                         .distinct()
+                         .order_by(Portfolio.symbol)]
 
     return render_template('main.html',
                          stocks=latest_data.to_dict('records'),
@@ -191,47 +327,66 @@ def upload():
         for file in files:
             if file and file.filename.lower().endswith('.csv'):
                 try:
-                    # Read and process the CSV file
-                    expected_columns = ['symbol', 'date', 'open', 'high', 'low', 'close', 'volume', 'nfb_nfs']
-                    df = pd.read_csv(file, header=0)
-
-                    # Standardize column names
-                    df.columns = df.columns.str.lower()
-                    if 'nfb/nfs' in df.columns:
-                        df = df.rename(columns={'nfb/nfs': 'nfb_nfs'})
-
-                    # Detect headerless CSV: if first column name looks like a stock symbol (no 'symbol'/'date' header)
-                    if 'date' not in df.columns:
-                        file.seek(0)
-                        df = pd.read_csv(file, header=None, names=expected_columns)
-                    
-                    # Convert date to consistent format
-                    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d')
-                    
-                    # Get unique dates from the current file
-                    unique_dates = df['date'].unique()
-                    
-                    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-                        # Delete existing records with matching dates
-                        cursor = conn.cursor()
-                        placeholders = ','.join(['?'] * len(unique_dates))
-                        cursor.execute(
-                            f'DELETE FROM stocks WHERE date IN ({placeholders})', 
-                            tuple(unique_dates)
-                        )
-                        conn.commit()
+                    # Small files are parsed directly; larger ones go through pandas
+                    file.seek(0, os.SEEK_END)
+                    small = file.tell() <= app.config['SMALL_CSV_MAX_BYTES']
+                    file.seek(0)
+                    rows = _read_small_csv(file) if small else None
+
+                    if rows is None:
+                        # Read and process the CSV file
+                        df = pd.read_csv(file, header=0)
+
+                        # Standardize column names
+                        df.columns = df.columns.str.lower()
+                        if 'nfb/nfs' in df.columns:
+                            df = df.rename(columns={'nfb/nfs': 'nfb_nfs'})
+
+                        # Detect headerless CSV: if first column name looks like a stock symbol (no 'symbol'/'date' header)
+                        if 'date' not in df.columns:
+                            file.seek(0)
+                            df = pd.read_csv(file, header=None, names=STOCK_COLUMNS)
                         
-                        # Insert new records
-                        df.to_sql('stocks', conn, if_exists='append', index=False)
+                        # Convert date to consistent format (ISO dates are already stored as-is)
+                        dates = df['date'].astype(str)
+                        if dates.str.match(ISO_DATE).all():
+                            df['date'] = dates
+                        else:
+                            try:
+                                parsed = pd.to_datetime(dates, format='%m/%d/%Y', cache=True)
+                            except ValueError:
+                                parsed = pd.to_datetime(dates, cache=True)
+                            df['date'] = parsed.dt.strftime('%Y-%m-%d')
+
+                        # Columns missing from the file are stored as NULL
+                        rows = list(df.reindex(columns=STOCK_COLUMNS).itertuples(index=False, name=None))
+                    
+                    # Insert new records, overwriting existing ones for the same symbol and date
+                    conn = get_stock_conn()
+                    conn.executemany('''
+                        INSERT INTO stocks (symbol, date, open, high, low, close, volume, nfb_nfs)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(symbol, date) DO UPDATE SET
+                            open = excluded.open,
+                            high = excluded.high,
+                            low = excluded.low,
+                            close = excluded.close,
+                            volume = excluded.volume,
+                            nfb_nfs = excluded.nfb_nfs
+                    ''', rows)
+                    conn.execute('UPDATE stock_meta SET version = version + 1 WHERE id = 1')
+                    conn.commit()
                     
                     processed_files += 1
-                    total_records += len(df)
+                    total_records += len(rows)
                 
                 except Exception as e:
+                    get_stock_conn().rollback()
                     flash(f'Error processing file {file.filename}: {str(e)}')
                     continue
         
         if processed_files > 0:
+            invalidate_stock_caches()
             flash(f'Successfully processed {processed_files} files with {total_records} total records')
         else:
             flash('No valid CSV files found in the selected folder')
@@ -242,23 +397,35 @@ def upload():
 
 @app.route('/symbol/<symbol>')
 def symbol_detail(symbol):
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        # Get all data for this symbol
-        df = pd.read_sql(f'''
-        SELECT date, open, high, low, close, volume
-        FROM stocks
-        WHERE symbol = ?
-        ORDER BY date
-        ''', conn, params=(symbol,))
-
-        # Get latest price
-        latest = pd.read_sql(f'''
-        SELECT *
-        FROM stocks
-        WHERE symbol = ?
-        ORDER BY date DESC
-        LIMIT 1
-        ''', conn, params=(symbol,)).iloc[0].to_dict()
+    conn = get_stock_conn()
+
+    # Version the page by the stock data version and this symbol's rows; unchanged data is answered with 304 before any rendering
+    max_date, row_count, version = conn.execute(
+        'SELECT MAX(date), COUNT(*), (SELECT version FROM stock_meta WHERE id = 1) FROM stocks WHERE symbol = ?', (symbol,)
+    ).fetchone()
+    etag = hashlib.md5(f'{symbol}|{version}|{max_date}|{row_count}'.encode()).hexdigest()
+    if row_count and request.if_none_match.contains_weak(etag):
+        return _symbol_cache_headers(make_response('', 304), etag)
+
+    # Get all data for this symbol
+    df = pd.read_sql_query('''
+    SELECT date, open, high, low, close, volume
+    FROM stocks
+    WHERE symbol = ?
+    ORDER BY date
+    ''', conn, params=(symbol,),
+        dtype={'open': 'float64', 'high': 'float64', 'low': 'float64', 'close': 'float64', 'volume': 'float64'})
+
+    # Get latest price (single row, no DataFrame needed)
+    cursor = conn.execute('''
+    SELECT *
+    FROM stocks
+    WHERE symbol = ?
+    ORDER BY date DESC
+    LIMIT 1
+    ''', (symbol,))
+    row = cursor.fetchone()
+    latest = dict(zip([column[0] for column in cursor.description], row)) if row else None
 
     if df.empty:
         flash(f'No data found for symbol {symbol}')
@@ -272,37 +439,34 @@ def symbol_detail(symbol):
     # Pass OHLCV data as JSON for client-side candlestick chart
     ohlcv = df.to_dict(orient='list')
 
-    return render_template('symbol.html',
+    response = make_response(render_template('symbol.html',
                          symbol=symbol,
                          latest=latest,
                          ohlcv=ohlcv,
                          high_52w=high_52w,
                          low_52w=low_52w,
-                         avg_volume=avg_volume)
+                         avg_volume=avg_volume))
+    return _symbol_cache_headers(response, etag)
+
+# Let browsers keep symbol pages but revalidate them, since an upload can change them at any time.
+# The ETag is weak so Flask-Compress leaves it unchanged across encodings.
+def _symbol_cache_headers(response, etag):
+    response.set_etag(etag, weak=True)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
 
 # Investment Tracking Routes
 @app.route('/')
 @app.route('/investments')
 def investments():
     investments = Investment.query.all()
-    portfolios = Portfolio.query.all()
+    portfolios = db.session.execute(db.select(Portfolio).options(db.load_only(
+        Portfolio.symbol, Portfolio.shares, Portfolio.average_price, Portfolio.latest_price, Portfolio.account
+    ))).scalars().all()
     
-    # Update latest prices from stock data
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        for p in portfolios:
-            latest_price = pd.read_sql('''
-                SELECT close FROM stocks 
-                WHERE symbol = ? 
-                ORDER BY date DESC 
-                LIMIT 1
-            ''', conn, params=(p.symbol,))['close'].iloc[0] if pd.read_sql('''
-                SELECT COUNT(*) as count FROM stocks 
-                WHERE symbol = ?
-            ''', conn, params=(p.symbol,))['count'].iloc[0] > 0 else None
-            
-            if latest_price:
-                p.latest_price = latest_price
-                db.session.commit()
+    # Show latest prices from stock data (read-only, not written back)
+    apply_latest_prices(portfolios)
     
     return render_template('investments/index.html', 
                          investments=investments,
@@ -324,15 +488,22 @@ def save_snapshot():
 
 @app.route('/investments/snapshots')
 def investment_snapshots():
-    snapshots = InvestmentSnapshot.query.order_by(InvestmentSnapshot.date.desc()).all()
-    return jsonify([{
+    snapshots = db.session.execute(db.select(
+        InvestmentSnapshot.id,
+        InvestmentSnapshot.date,
+        InvestmentSnapshot.total_invested,
+        InvestmentSnapshot.current_value,
+        InvestmentSnapshot.profit_loss,
+        InvestmentSnapshot.profit_loss_pct
+    ).order_by(InvestmentSnapshot.date.desc())).all()
+    return Response(orjson.dumps([{
         'id': s.id,
         'date': s.date.strftime('%Y-%m-%d %H:%M'),
         'total_invested': s.total_invested,
         'current_value': s.current_value,
         'profit_loss': s.profit_loss,
         'profit_loss_pct': s.profit_loss_pct
-    } for s in snapshots])
+    } for s in snapshots]), mimetype='application/json')
 
 @app.route('/investments/snapshots/<int:id>', methods=['DELETE'])
 def delete_snapshot(id):
@@ -345,22 +516,19 @@ def delete_snapshot(id):
 def save_account_snapshot():
     data = request.get_json()
     accounts = data.get('accounts', [])
-    saved = 0
-    for acct in accounts:
-        snapshot = AccountSnapshot(
-            account_name=acct['account_name'],
-            goal=acct['goal'],
-            platform=acct['platform'],
-            type=acct['type'],
-            total_invested=acct['total_invested'],
-            current_value=acct['current_value'],
-            profit_loss=acct['profit_loss'],
-            profit_loss_pct=acct['profit_loss_pct']
-        )
-        db.session.add(snapshot)
-        saved += 1
+    mappings = [{
+        'account_name': acct['account_name'],
+        'goal': acct['goal'],
+        'platform': acct['platform'],
+        'type': acct['type'],
+        'total_invested': acct['total_invested'],
+        'current_value': acct['current_value'],
+        'profit_loss': acct['profit_loss'],
+        'profit_loss_pct': acct['profit_loss_pct']
+    } for acct in accounts]
+    db.session.bulk_insert_mappings(AccountSnapshot, mappings)
     db.session.commit()
-    return jsonify({'status': 'success', 'saved': saved, 'date': datetime.utcnow().strftime('%Y-%m-%d %H:%M')})
+    return jsonify({'status': 'success', 'saved': len(mappings), 'date': datetime.utcnow().strftime('%Y-%m-%d %H:%M')})
 
 @app.route('/investments/account-history')
 def account_history():
@@ -371,11 +539,22 @@ def account_history():
 @app.route('/investments/account-snapshots')
 def account_snapshots():
     account = request.args.get('account', '')
-    query = AccountSnapshot.query.order_by(AccountSnapshot.date.desc())
+    query = db.select(
+        AccountSnapshot.id,
+        AccountSnapshot.date,
+        AccountSnapshot.account_name,
+        AccountSnapshot.goal,
+        AccountSnapshot.platform,
+        AccountSnapshot.type,
+        AccountSnapshot.total_invested,
+        AccountSnapshot.current_value,
+        AccountSnapshot.profit_loss,
+        AccountSnapshot.profit_loss_pct
+    ).order_by(AccountSnapshot.date.desc())
     if account:
         query = query.filter_by(account_name=account)
-    snapshots = query.all()
-    return jsonify([{
+    snapshots = db.session.execute(query).all()
+    return Response(orjson.dumps([{
         'id': s.id,
         'date': s.date.strftime('%Y-%m-%d %H:%M'),
         'account_name': s.account_name,
@@ -386,7 +565,7 @@ def account_snapshots():
         'current_value': s.current_value,
         'profit_loss': s.profit_loss,
         'profit_loss_pct': s.profit_loss_pct
-    } for s in snapshots])
+    } for s in snapshots]), mimetype='application/json')
 
 @app.route('/investments/account-snapshots/<int:id>', methods=['DELETE'])
 def delete_account_snapshot(id):
@@ -403,7 +582,12 @@ def bulk_delete_account_snapshots():
     if account:
         query = query.filter_by(account_name=account)
     if date:
-        query = query.filter(db.func.strftime('%Y-%m-%d', AccountSnapshot.date) == date)
+        try:
+            day_start = datetime.strptime(date, '%Y-%m-%d')
+        except ValueError:
+            # A malformed date matches no snapshots, as the old strftime comparison did
+            return jsonify({'status': 'success', 'deleted': 0})
+        query = query.filter(AccountSnapshot.date >= day_start, AccountSnapshot.date < day_start + timedelta(days=1))
     count = query.delete(synchronize_session=False)
     db.session.commit()
     return jsonify({'status': 'success', 'deleted': count})
@@ -484,8 +668,6 @@ def delete_investment(id):
 
 @app.route('/investments/transactions/<int:investment_id>', methods=['GET', 'POST'])
 def transactions(investment_id):
-    investment = Investment.query.get_or_404(investment_id)
-    
     if request.method == 'POST':
         date_str = request.form['date']
         amount = float(request.form['amount'])
@@ -493,20 +675,28 @@ def transactions(investment_id):
         
         date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
+        # Increment the total in SQL so concurrent posts cannot overwrite each other
+        result = db.session.execute(
+            db.update(Investment)
+            .where(Investment.id == investment_id)
+            .values(total_amount=Investment.total_amount + amount)
+        )
+        if result.rowcount == 0:
+            abort(404)
+        
         transaction = Transaction(
             date=date,
             amount=amount,
-            investment_id=investment.id,
+            investment_id=investment_id,
             notes=notes
         )
         
-        investment.total_amount += amount
-        
         db.session.add(transaction)
         db.session.commit()
         
-        return redirect(url_for('transactions', investment_id=investment.id))
+        return redirect(url_for('transactions', investment_id=investment_id))
     
+    investment = Investment.query.get_or_404(investment_id)
     transactions = Transaction.query.filter_by(investment_id=investment_id).order_by(Transaction.date.desc()).all()
     return render_template(
         'investments/transactions.html', 
@@ -555,23 +745,11 @@ def update_market_value():
     
 @app.route('/portfolio')
 def portfolio():
-    portfolios = Portfolio.query.filter(Portfolio.symbol != 'NON-STOCK').all()
-    # Update latest prices from stock data
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        for p in portfolios:
-            latest_price = pd.read_sql('''
-                SELECT close FROM stocks 
-                WHERE symbol = ? 
-                ORDER BY date DESC 
-                LIMIT 1
-            ''', conn, params=(p.symbol,))['close'].iloc[0] if pd.read_sql('''
-                SELECT COUNT(*) as count FROM stocks 
-                WHERE symbol = ?
-            ''', conn, params=(p.symbol,))['count'].iloc[0] > 0 else None
-            
-            if latest_price:
-                p.latest_price = latest_price
-                db.session.commit()
+    portfolios = db.session.execute(db.select(Portfolio).options(db.load_only(
+        Portfolio.symbol, Portfolio.shares, Portfolio.average_price, Portfolio.latest_price, Portfolio.account
+    )).filter(Portfolio.symbol != 'NON-STOCK')).scalars().all()
+    # Show latest prices from stock data (read-only, not written back)
+    apply_latest_prices(portfolios)
     
     investments = Investment.query.all()
     return render_template('portfolio/index.html', 
@@ -584,8 +762,7 @@ def add_portfolio():
     investments = Investment.query.all()
     
     # Get all available symbols from the stock database
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        symbols = pd.read_sql('SELECT DISTINCT symbol FROM stocks ORDER BY symbol', conn)['symbol'].tolist()
+    symbols = get_symbols(get_stock_conn())
     
     if request.method == 'POST':
         symbol = request.form['symbol'].upper()
@@ -617,8 +794,7 @@ def edit_portfolio(id):
     investments = Investment.query.all()
     
     # Get all available symbols from the stock database
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        symbols = pd.read_sql('SELECT DISTINCT symbol FROM stocks ORDER BY symbol', conn)['symbol'].tolist()  # Changed from .tolists() to .tolist()
+    symbols = get_symbols(get_stock_conn())
     
     filter_symbol = request.args.get('filter_symbol', '')
     filter_account = request.args.get('filter_account', '')
@@ -654,81 +830,48 @@ def delete_portfolio(id):
 
 @app.route('/portfolio/update_prices')
 def update_prices():
-    portfolios = Portfolio.query.all()
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        for p in portfolios:
-            latest_price = pd.read_sql('''
-                SELECT close FROM stocks 
-                WHERE symbol = ? 
-                ORDER BY date DESC 
-                LIMIT 1
-            ''', conn, params=(p.symbol,))['close'].iloc[0] if pd.read_sql('''
-                SELECT COUNT(*) as count FROM stocks 
-                WHERE symbol = ?
-            ''', conn, params=(p.symbol,))['count'].iloc[0] > 0 else None
-            
-            if latest_price:
-                p.latest_price = latest_price
-                db.session.commit()
+    portfolios = db.session.execute(db.select(Portfolio).options(db.load_only(Portfolio.symbol, Portfolio.latest_price))).scalars().all()
+    prices = get_latest_prices(get_stock_conn())
+    for p in portfolios:
+        latest_price = prices.get(p.symbol)
+        if latest_price:
+            p.latest_price = latest_price
+    db.session.commit()
     
     return redirect(url_for('portfolio'))
 
 @app.route('/my-stocks')
 def my_stocks():
-    # Query all portfolios from the database, excluding NON-STOCK
-    portfolios = Portfolio.query.filter(Portfolio.symbol != 'NON-STOCK').all()
-    
-    # Update latest prices from stock data
-    with sqlite3.connect(app.config['STOCK_DATABASE']) as conn:
-        for p in portfolios:
-            latest_price = pd.read_sql('''
-                SELECT close FROM stocks 
-                WHERE symbol = ? 
-                ORDER BY date DESC 
-                LIMIT 1
-            ''', conn, params=(p.symbol,))['close'].iloc[0] if pd.read_sql('''
-                SELECT COUNT(*) as count FROM stocks 
-                WHERE symbol = ?
-            ''', conn, params=(p.symbol,))['count'].iloc[0] > 0 else None
-            
-            if latest_price:
-                p.latest_price = latest_price
-                db.session.commit()
-    
-    # Aggregate portfolio data by symbol
-    stocks = {}
-    for portfolio in portfolios:
-        symbol = portfolio.symbol
-        if symbol not in stocks:
-            stocks[symbol] = {
-                'symbol': symbol,
-                'total_shares': 0,
-                'total_cost': 0,
-                'market_value': 0,
-                'profit': 0
-            }
-        
-        stocks[symbol]['total_shares'] += portfolio.shares
-        stocks[symbol]['total_cost'] += portfolio.total_cost
-        stocks[symbol]['market_value'] += portfolio.market_value
-        stocks[symbol]['profit'] += portfolio.profit
-    
+    # Stored latest price of the first lot (by id) for each symbol that has a non-zero one
+    first_lot = db.aliased(Portfolio)
+    first_latest_price = db.select(first_lot.latest_price).where(
+        first_lot.symbol == Portfolio.symbol, first_lot.latest_price != 0
+    ).order_by(first_lot.id).limit(1).scalar_subquery()
+
+    # Aggregate portfolio data by symbol in the database, excluding NON-STOCK
+    rows = db.session.execute(db.select(
+        Portfolio.symbol,
+        db.func.sum(Portfolio.shares),
+        db.func.sum(Portfolio.total_cost),
+        db.func.sum(Portfolio.market_value),
+        first_latest_price
+    ).filter(Portfolio.symbol != 'NON-STOCK')
+     .group_by(Portfolio.symbol)
+     .order_by(db.func.min(Portfolio.id))).all()
+    stocks = pd.DataFrame(rows, columns=['symbol', 'total_shares', 'total_cost', 'market_value', 'latest_price'])
+    stocks['latest_price'] = stocks['latest_price'].astype(float)
+
+    # Value holdings at the latest close from stock data (read-only, not written back)
+    prices = stocks['symbol'].map(get_latest_prices(get_stock_conn())).astype(float)
+    prices = prices.where(prices != 0)
+    stocks['market_value'] = (stocks['total_shares'] * prices).fillna(stocks['market_value'])
+    stocks['latest_price'] = prices.fillna(stocks['latest_price']).fillna(0)
+    stocks['profit'] = stocks['market_value'] - stocks['total_cost']
+
     # Calculate average price for each symbol
-    for symbol, data in stocks.items():
-        if data['total_shares'] > 0:
-            data['average_price'] = data['total_cost'] / data['total_shares']
-        else:
-            data['average_price'] = 0
-        
-        # Use the latest price from any portfolio entry for this symbol
-        for portfolio in portfolios:
-            if portfolio.symbol == symbol and portfolio.latest_price:
-                data['latest_price'] = portfolio.latest_price
-                break
-        else:
-            data['latest_price'] = 0
-    
-    return render_template('mystocks.html', stocks=list(stocks.values()), now=datetime.now)
+    stocks['average_price'] = (stocks['total_cost'] / stocks['total_shares'].where(stocks['total_shares'] > 0)).fillna(0)
+
+    return render_template('mystocks.html', stocks=stocks.to_dict('records'), now=datetime.now)
     
 @app.route('/set-theme/<theme>')
 def set_theme(theme):